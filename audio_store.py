@@ -0,0 +1,73 @@
+import time
+import uuid
+import logging
+from collections import OrderedDict
+from typing import Optional, Tuple, Iterator
+
+
+class AudioStore:
+    """In-memory store for generated audio, capped by total size and honoring expiry.
+
+    Audio is kept once as raw bytes and referenced by id, so neither responses
+    nor conversation history need to carry the base64 payload.
+    """
+
+    def __init__(self, max_bytes: int = 64 * 1024 * 1024, ttl_seconds: int = 3600):
+        self.max_bytes = max_bytes
+        self.ttl_seconds = ttl_seconds
+        self.total_bytes = 0
+        # audio_id -> (expires_at, audio bytes), oldest first
+        self._blobs: "OrderedDict[str, Tuple[int, bytes]]" = OrderedDict()
+
+    def put(self, audio: bytes) -> Optional[Tuple[str, int]]:
+        """Store audio, returns (audio_id, expires_at) or None if it can never fit"""
+        if len(audio) > self.max_bytes:
+            logging.warning(f"Audio of {len(audio)} bytes exceeds audio store capacity of {self.max_bytes} bytes")
+            return None
+
+        self.purge_expired()
+        while self._blobs and self.total_bytes + len(audio) > self.max_bytes:
+            evicted_id, (_, evicted) = self._blobs.popitem(last=False)
+            self.total_bytes -= len(evicted)
+            logging.info(f"Evicted audio {evicted_id} from store to free {len(evicted)} bytes")
+
+        audio_id = f"audio_{uuid.uuid4().hex[:12]}"
+        expires_at = int(time.time()) + self.ttl_seconds
+        self._blobs[audio_id] = (expires_at, audio)
+        self.total_bytes += len(audio)
+        return audio_id, expires_at
+
+    def get(self, audio_id: str) -> Optional[bytes]:
+        entry = self._blobs.get(audio_id)
+        if entry is None:
+            return None
+        expires_at, audio = entry
+        if expires_at <= time.time():
+            self.delete(audio_id)
+            return None
+        return audio
+
+    def delete(self, audio_id: str) -> bool:
+        entry = self._blobs.pop(audio_id, None)
+        if entry is None:
+            return False
+        self.total_bytes -= len(entry[1])
+        return True
+
+    def purge_expired(self) -> int:
+        # Every blob shares the same ttl, so insertion order is also expiry order
+        now = time.time()
+        purged = 0
+        while self._blobs:
+            audio_id, (expires_at, _) = next(iter(self._blobs.items()))
+            if expires_at > now:
+                break
+            self.delete(audio_id)
+            purged += 1
+        return purged
+
+    @staticmethod
+    def iter_chunks(audio: bytes, chunk_size: int = 64 * 1024) -> Iterator[bytes]:
+        view = memoryview(audio)
+        for start in range(0, len(view), chunk_size):
+            yield bytes(view[start:start + chunk_size])
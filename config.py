@@ -5,6 +5,15 @@ MODEL_MAPPING = {
     "keyless-mixtral-8x7b": "mistralai/Mixtral-8x7B-Instruct-v0.1",
     "keyless-meta-Llama-3.3-70B-Instruct-Turbo": "meta-llama/Llama-3.3-70B-Instruct-Turbo"
 }
+# Model ids that route each request to the best performing of several MODEL_MAPPING models
+ROUTING_ALIASES = {
+    "keyless-auto": [
+        "keyless-gpt-4o-mini",
+        "keyless-claude-3-haiku",
+        "keyless-meta-Llama-3.3-70B-Instruct-Turbo",
+        "keyless-mixtral-8x7b"
+    ]
+}
 VOICES = {
     # English Voices - Standard
     'en_uk_001': {'name': 'Narrator (Chris)', 'language': 'en-UK', 'category': 'standard'}, #works
@@ -122,4 +131,26 @@ VOICES = {
     'es_mx_002': {'name': 'Álex (Warm)', 'language': 'es-MX', 'category': 'standard'}, # not working
     'es_mx_male_transformer': {'name': 'Optimus Prime (Mexican)', 'language': 'es-MX', 'category': 'character'}, # not working
     'es_mx_female_supermom': {'name': 'Super Mamá', 'language': 'es-MX', 'category': 'character'} # not working
-}
\ No newline at end of file
+}
+
+# Voice used instead of a voice that the health prober found broken, per language
+VOICE_FALLBACKS = {
+    'en-US': 'en_us_002',
+    'en-UK': 'en_uk_001',
+    'en-AU': 'en_au_001',
+    'id-ID': 'id_male_darma',
+    'it-IT': 'it_male_m18',
+    'ja-JP': 'jp_male_shuichiro',
+    'pt-PT': 'pt_female_lhays',
+    'pt-BR': 'pt_female_lhays',
+    'es-ES': 'es_male_m3',
+    'es-MX': 'es_male_m3'
+}
+
+# Voices marked "# not working" above, the health prober checks them less often
+UNRELIABLE_VOICES = {
+    'en_male_petercullen', 'fr_001', 'fr_002', 'de_001', 'de_002', 'id_female_noor',
+    'jp_001', 'jp_003', 'jp_005', 'jp_006', 'jp_male_osada', 'jp_male_matsuo', 'jp_female_yagishaki',
+    'kr_002', 'kr_004', 'kr_003', 'br_003', 'br_004', 'br_005', 'pt_male_transformer',
+    'es_002', 'es_mx_002', 'es_mx_male_transformer', 'es_mx_female_supermom'
+}
@@ -0,0 +1,93 @@
+import sys
+import weakref
+from typing import Dict, List, Optional, Tuple
+
+
+class MessageNode:
+    """One immutable message in a conversation, linked to the message before it.
+
+    Conversations are just pointers to their last node, so conversations that
+    start the same way share the nodes of their common prefix.
+    """
+    __slots__ = ("role", "content", "audio", "parent", "length", "__weakref__")
+
+    def __init__(self, role: str, content: Optional[str], audio, parent: Optional["MessageNode"]):
+        self.role = role
+        self.content = content
+        self.audio = audio
+        self.parent = parent
+        self.length = parent.length + 1 if parent is not None else 1
+
+
+def _intern(text: Optional[str]) -> Optional[str]:
+    return sys.intern(text) if text is not None else None
+
+
+class ConversationStore:
+    """Conversation histories as persistent linked lists with interned, shared nodes.
+
+    Appending a message that some other conversation already has after the same
+    prefix reuses that node, so identical system prompts and opening turns are
+    stored once, and forking a conversation only copies a pointer. Nodes are
+    freed as soon as no conversation reaches them.
+    """
+
+    def __init__(self):
+        self._tails: Dict[str, Optional[MessageNode]] = {}
+        # (id(parent), role, content, audio id) -> node; a live node keeps its parent alive, so ids can't be stale
+        self._nodes: "weakref.WeakValueDictionary[Tuple, MessageNode]" = weakref.WeakValueDictionary()
+
+    def __contains__(self, conversation_id: str) -> bool:
+        return conversation_id in self._tails
+
+    def __len__(self) -> int:
+        return len(self._tails)
+
+    def create(self, conversation_id: str):
+        self._tails.setdefault(conversation_id, None)
+
+    def messages(self, conversation_id: str) -> List[MessageNode]:
+        """Messages of a conversation, oldest first"""
+        messages = []
+        node = self._tails.get(conversation_id)
+        while node is not None:
+            messages.append(node)
+            node = node.parent
+        messages.reverse()
+        return messages
+
+    def append(self, conversation_id: str, message) -> MessageNode:
+        """Append a ChatMessage (or anything with role, content and audio) and return its node"""
+        parent = self._tails.get(conversation_id)
+        audio = getattr(message, "audio", None)
+        # Intern first so the key and the node hold the shared strings, not this request's copies
+        role, content = _intern(message.role), _intern(message.content)
+        key = (id(parent), role, content, audio.id if audio is not None else None)
+        node = self._nodes.get(key)
+        if node is None or node.parent is not parent or node.audio != audio:
+            node = MessageNode(role, content, audio, parent)
+            self._nodes[key] = node
+        self._tails[conversation_id] = node
+        return node
+
+    def fork(self, source_id: str, target_id: str, length: Optional[int] = None):
+        """Start target_id as a copy of source_id, optionally of only its first `length` messages"""
+        if source_id not in self._tails:
+            raise KeyError(source_id)
+        node = self._tails[source_id]
+        if length is not None:
+            if length < 0:
+                raise ValueError("length must not be negative")
+            while node is not None and node.length > length:
+                node = node.parent
+        self._tails[target_id] = node
+
+    def pop(self, conversation_id: str) -> List[str]:
+        """Remove a conversation, returning the audio ids that no other conversation still references"""
+        node = self._tails.pop(conversation_id)
+        audio_refs = []
+        while node is not None:
+            if node.audio is not None and node.audio.id:
+                audio_refs.append((node.audio.id, weakref.ref(node)))
+            node = node.parent
+        return [audio_id for audio_id, ref in audio_refs if ref() is None]
@@ -0,0 +1,160 @@
+import atexit
+import copy
+import hashlib
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import random
+import time
+from typing import Any, Dict, Optional
+
+DEFAULT_MAX_PAYLOAD_CHARS = 256
+
+
+def parse_sample_rates(spec: Optional[str]) -> Dict[str, float]:
+    """Parse "event=rate,event=rate" (e.g. "tts.chunk=0.1,chat.request.payload=0") into a dict"""
+    rates = {}
+    if not spec:
+        return rates
+    for item in spec.split(","):
+        if "=" not in item:
+            continue
+        event, rate = item.split("=", 1)
+        try:
+            rates[event.strip()] = min(max(float(rate), 0.0), 1.0)
+        except ValueError:
+            logging.warning(f"Ignoring invalid log sample rate: {item}")
+    return rates
+
+
+def redact(value: Any, max_chars: int = DEFAULT_MAX_PAYLOAD_CHARS) -> Any:
+    """Truncate large payloads, keeping a length and short hash so entries can still be correlated"""
+    if isinstance(value, (dict, list)):
+        value = json.dumps(value, default=str, ensure_ascii=False)
+    if isinstance(value, (bytes, bytearray)):
+        return f"<{len(value)} bytes sha256:{hashlib.sha256(value).hexdigest()[:12]}>"
+    if isinstance(value, str) and len(value) > max_chars:
+        digest = hashlib.sha256(value.encode("utf-8", "replace")).hexdigest()[:12]
+        return f"{value[:max_chars]}... <{len(value)} chars sha256:{digest}>"
+    return value
+
+
+class SamplingFilter(logging.Filter):
+    """Drops a share of records per event type before they are queued"""
+
+    def __init__(self, rates: Optional[Dict[str, float]] = None):
+        super().__init__()
+        self.rates = rates or {}
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        rate = self.rates.get(getattr(record, "event", None), 1.0)
+        return rate >= 1.0 or random.random() < rate
+
+
+class JsonFormatter(logging.Formatter):
+    def __init__(self, max_payload_chars: int = DEFAULT_MAX_PAYLOAD_CHARS):
+        super().__init__()
+        self.max_payload_chars = max_payload_chars
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "ts": time.strftime("%Y-%m-%dT%H:%M:%S", time.gmtime(record.created)) + f".{int(record.msecs):03d}Z",
+            "level": record.levelname,
+            "event": getattr(record, "event", None),
+            "message": record.getMessage(),
+        }
+        for key, value in (getattr(record, "fields", None) or {}).items():
+            entry[key] = redact(value, self.max_payload_chars)
+        if record.exc_info:
+            entry["exc_info"] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str, ensure_ascii=False)
+
+
+class DeferredQueueHandler(logging.handlers.QueueHandler):
+    """Queues records without formatting them, so tracebacks are rendered by the listener thread"""
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        record = copy.copy(record)
+        # Resolve %-args now, they may be mutated after the call returns
+        record.msg = record.getMessage()
+        record.args = None
+        return record
+
+
+class _LoggingState:
+    listener: Optional[logging.handlers.QueueListener] = None
+    sampling_filter: Optional[SamplingFilter] = None
+
+
+def setup_logging(level: Optional[str] = None,
+                  sample_rates: Optional[Dict[str, float]] = None,
+                  max_payload_chars: Optional[int] = None) -> None:
+    """Route the root logger through a background queue so handlers never block the event loop.
+
+    Defaults come from LOG_LEVEL, LOG_SAMPLE_RATES and LOG_MAX_PAYLOAD_CHARS.
+    """
+    if _LoggingState.listener is not None:
+        return
+
+    level = level or os.getenv("LOG_LEVEL", "INFO")
+    if sample_rates is None:
+        sample_rates = parse_sample_rates(os.getenv("LOG_SAMPLE_RATES"))
+    if max_payload_chars is None:
+        max_payload_chars = int(os.getenv("LOG_MAX_PAYLOAD_CHARS", DEFAULT_MAX_PAYLOAD_CHARS))
+
+    stream_handler = logging.StreamHandler()
+    stream_handler.setFormatter(JsonFormatter(max_payload_chars))
+
+    log_queue = queue.SimpleQueue()
+    queue_handler = DeferredQueueHandler(log_queue)
+    sampling_filter = SamplingFilter(sample_rates)
+    queue_handler.addFilter(sampling_filter)
+
+    root = logging.getLogger()
+    for handler in list(root.handlers):
+        root.removeHandler(handler)
+    root.addHandler(queue_handler)
+    root.setLevel(level.upper())
+
+    listener = logging.handlers.QueueListener(log_queue, stream_handler, respect_handler_level=True)
+    listener.start()
+    atexit.register(listener.stop)
+
+    _LoggingState.listener = listener
+    _LoggingState.sampling_filter = sampling_filter
+
+
+def set_log_level(level: str) -> str:
+    """Change the root log level at runtime, returns the level now in effect"""
+    root = logging.getLogger()
+    root.setLevel(level.upper())
+    return logging.getLevelName(root.level)
+
+
+def get_log_level() -> str:
+    return logging.getLevelName(logging.getLogger().level)
+
+
+def set_sample_rates(rates: Dict[str, float]) -> Dict[str, float]:
+    """Replace the per-event sampling rates at runtime"""
+    if _LoggingState.sampling_filter is None:
+        return {}
+    _LoggingState.sampling_filter.rates = {
+        event: min(max(float(rate), 0.0), 1.0) for event, rate in rates.items()
+    }
+    return dict(_LoggingState.sampling_filter.rates)
+
+
+def get_sample_rates() -> Dict[str, float]:
+    if _LoggingState.sampling_filter is None:
+        return {}
+    return dict(_LoggingState.sampling_filter.rates)
+
+
+def log_event(event: str, message: str, level: int = logging.INFO, exc_info: bool = False, **fields) -> None:
+    """Log a structured event. Fields are redacted off the request path by the queue listener."""
+    logger = logging.getLogger()
+    if logger.isEnabledFor(level):
+        logger.log(level, message, exc_info=exc_info, extra={"event": event, "fields": fields})
@@ -0,0 +1,126 @@
+import time
+from typing import Dict, List, Optional, Any
+
+EWMA_ALPHA = 0.2
+ERROR_RATE_THRESHOLD = 0.5
+ERROR_RATE_HALF_LIFE_SECONDS = 120
+FAILURE_COOLDOWN_SECONDS = 30
+ERROR_PENALTY = 4.0
+# Assumed time to first token for a model that has failed before ever answering
+UNMEASURED_TTFT_SECONDS = 5.0
+
+
+class ModelStats:
+    __slots__ = ("ttft", "error_rate", "updated_at", "requests", "failures", "last_failure", "last_trial")
+
+    def __init__(self):
+        self.ttft: Optional[float] = None  # EWMA time to first token, seconds
+        self.error_rate: float = 0.0       # EWMA of failures (1) and successes (0), decays over time
+        self.updated_at = time.monotonic()
+        self.requests = 0
+        self.failures = 0
+        self.last_failure: Optional[float] = None
+        self.last_trial: Optional[float] = None
+
+    def decay(self, now: float):
+        """Let the error rate fade while a model gets no traffic, so past failures don't stick forever"""
+        self.error_rate *= 0.5 ** ((now - self.updated_at) / ERROR_RATE_HALF_LIFE_SECONDS)
+        self.updated_at = now
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "ttft_ms": int(self.ttft * 1000) if self.ttft is not None else None,
+            "error_rate": round(self.error_rate, 3),
+            "requests": self.requests,
+            "failures": self.failures
+        }
+
+
+class ModelRouter:
+    """Tracks per-model latency and errors and orders the models behind a routing alias by expected performance"""
+
+    def __init__(self, aliases: Dict[str, List[str]]):
+        self.aliases = aliases
+        self.stats: Dict[str, ModelStats] = {}
+
+    def is_alias(self, model: str) -> bool:
+        return model in self.aliases
+
+    def _stats(self, model: str) -> ModelStats:
+        if model not in self.stats:
+            self.stats[model] = ModelStats()
+        return self.stats[model]
+
+    def record_success(self, model: str, ttft: float):
+        stats = self._stats(model)
+        stats.decay(time.monotonic())
+        stats.requests += 1
+        stats.ttft = ttft if stats.ttft is None else EWMA_ALPHA * ttft + (1 - EWMA_ALPHA) * stats.ttft
+        stats.error_rate = (1 - EWMA_ALPHA) * stats.error_rate
+
+    def record_failure(self, model: str, counted: bool = False):
+        """Record a failed request; counted is set when its first token was already recorded as a success"""
+        stats = self._stats(model)
+        now = time.monotonic()
+        stats.decay(now)
+        if not counted:
+            stats.requests += 1
+        stats.failures += 1
+        stats.error_rate = EWMA_ALPHA + (1 - EWMA_ALPHA) * stats.error_rate
+        stats.last_failure = now
+
+    def _eligible(self, model: str, now: float) -> bool:
+        stats = self.stats.get(model)
+        if stats is None or stats.error_rate < ERROR_RATE_THRESHOLD:
+            return True
+        return stats.last_failure is None or now - stats.last_failure >= FAILURE_COOLDOWN_SECONDS
+
+    def _due_for_trial(self, model: str, now: float) -> bool:
+        """A model whose last outcome was a failure gets one trial request per cooldown period"""
+        stats = self.stats.get(model)
+        if stats is None or stats.last_failure is None:
+            return False
+        if stats.ttft is not None and stats.error_rate < ERROR_RATE_THRESHOLD:
+            # It is measured and healthy enough to compete on score
+            return False
+        last_attempt = max(stats.last_failure, stats.last_trial or 0.0)
+        return now - last_attempt >= FAILURE_COOLDOWN_SECONDS
+
+    def _score(self, model: str) -> float:
+        stats = self.stats.get(model)
+        if stats is None:
+            # Unmeasured models go first so every model gets a latency sample
+            return 0.0
+        ttft = stats.ttft if stats.ttft is not None else UNMEASURED_TTFT_SECONDS
+        return ttft * (1 + ERROR_PENALTY * stats.error_rate)
+
+    def candidates(self, alias: str) -> List[str]:
+        """Models behind an alias, best first; ineligible models are kept at the end as a last resort.
+
+        A failing model whose cooldown has passed is put first once, so it gets measured again.
+        """
+        now = time.monotonic()
+        for model in self.aliases[alias]:
+            if model in self.stats:
+                self.stats[model].decay(now)
+        models = sorted(self.aliases[alias], key=self._score)
+        eligible = [model for model in models if self._eligible(model, now)]
+        ordered = eligible + [model for model in models if model not in eligible]
+
+        trial = next((model for model in ordered if self._due_for_trial(model, now)), None)
+        if trial is not None:
+            self.stats[trial].last_trial = now
+            ordered.remove(trial)
+            ordered.insert(0, trial)
+        return ordered
+
+    def snapshot(self) -> Dict[str, Any]:
+        # Read-only, so the trial slot isn't used up by looking at the stats
+        now = time.monotonic()
+        return {
+            "aliases": {
+                alias: sorted(models, key=lambda model: (not self._eligible(model, now), self._score(model)))
+                for alias, models in self.aliases.items()
+            },
+            "models": {model: stats.to_dict() for model, stats in self.stats.items()}
+        }
@@ -5,6 +5,7 @@ import time
 class AudioConfig(BaseModel):
     voice: str = "alloy"
     format: str = "wav"
+    inline: bool = False  # include base64 audio in the response instead of only its id
 
 class AudioData(BaseModel):
     id: Optional[str] = None
@@ -13,6 +14,11 @@ class AudioData(BaseModel):
     transcript: Optional[str] = None
 
 
+class LoggingSettings(BaseModel):
+    level: Optional[str] = None
+    sample_rates: Optional[Dict[str, float]] = None
+
+
 class ModelInfo(BaseModel):
     id: str
     object: str = "model"
@@ -62,6 +68,7 @@ class ChatCompletionResponse(BaseModel):
 class DeltaMessage(BaseModel):
     role: Optional[str] = None
     content: Optional[str] = None
+    audio: Optional[AudioData] = None
 
 class ChatCompletionStreamResponseChoice(BaseModel):
     index: int
@@ -1,4 +1,6 @@
-from fastapi import FastAPI, HTTPException
+from fastapi import FastAPI, HTTPException, WebSocket, WebSocketDisconnect
+from fastapi.responses import JSONResponse
+from contextlib import asynccontextmanager
 from fastapi.middleware.cors import CORSMiddleware
 from typing import List, Dict, Optional
 from fastapi.responses import StreamingResponse
@@ -6,15 +8,20 @@ import logging
 import uuid
 import time
 import json
+import asyncio
 import httpx
-from datetime import datetime, timedelta
-from models import ChatMessage, ChatCompletionRequest, ChatCompletionResponse, ChatCompletionResponseChoice, ChatCompletionResponseUsage, DeltaMessage, ModelInfo, AudioData, AudioConfig, ChatCompletionStreamResponse, ChatCompletionStreamResponseChoice
-from config import MODEL_MAPPING, VOICES
+from models import ChatMessage, ChatCompletionRequest, ChatCompletionResponse, ChatCompletionResponseChoice, ChatCompletionResponseUsage, DeltaMessage, ModelInfo, AudioData, AudioConfig, ChatCompletionStreamResponse, ChatCompletionStreamResponseChoice, LoggingSettings
+from config import MODEL_MAPPING, ROUTING_ALIASES, VOICES, VOICE_FALLBACKS, UNRELIABLE_VOICES
 from tts import TTSRequest, TTSEngine
+from audio_store import AudioStore
+from voice_health import VoiceHealthProber
+from model_router import ModelRouter
+from history import ConversationStore, MessageNode
+from logging_config import setup_logging, log_event, set_log_level, get_log_level, set_sample_rates, get_sample_rates
 import base64
 import os 
 import argparse
-from fake_useragent import UserAgent
+from http.cookiejar import CookieJar, DefaultCookiePolicy
 
 def parse_arguments():
     parser = argparse.ArgumentParser(description='Start the chat API server')
@@ -22,9 +29,90 @@ def parse_arguments():
                        help='TikTok session ID for TTS functionality (overrides TIKTOK_SESSION_ID env variable)',
                        default=None)
     return parser.parse_args()
-app = FastAPI()
 
-logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+class ServerState:
+    """Shared resources created lazily or during startup warm-up"""
+    http_client: Optional[httpx.AsyncClient] = None
+    user_agent: Optional["UserAgent"] = None
+    # (user_agent, vqd token, fetched at) from warm-up, handed to the first chat request
+    prefetched_vqd: Optional[tuple] = None
+    ready: bool = False
+    checks: Dict[str, str] = {}
+
+PREFETCHED_VQD_MAX_AGE = 60
+WARMUP_RETRY_SECONDS = 5
+
+def get_http_client() -> httpx.AsyncClient:
+    """Pooled client for upstream calls so DNS/TLS setup is paid once, not per request.
+
+    Its cookie jar rejects every cookie, so requests made with different user agents stay unlinked.
+    """
+    if ServerState.http_client is None or ServerState.http_client.is_closed:
+        ServerState.http_client = httpx.AsyncClient(
+            timeout=httpx.Timeout(30.0, connect=10.0),
+            cookies=CookieJar(policy=DefaultCookiePolicy(allowed_domains=[]))
+        )
+    return ServerState.http_client
+
+async def warm_up():
+    """Prepare everything the first request would otherwise pay for, retrying until DuckDuckGo is reachable"""
+    if ServerState.user_agent is None:
+        # Loading the browser database is blocking file I/O, keep it off the event loop
+        await asyncio.to_thread(get_user_agent_provider)
+    ServerState.checks["user_agent"] = "ok"
+
+    tts_engine = TTSEngine.get_instance()
+    if tts_engine:
+        ServerState.checks["tts"] = "ok" if await tts_engine.warm_up() else "unreachable"
+    else:
+        ServerState.checks["tts"] = "disabled"
+
+    while True:
+        user_agent = get_next_user_agent()
+        vqd_token = await update_vqd_token(user_agent)
+        if vqd_token:
+            ServerState.prefetched_vqd = (user_agent, vqd_token, time.monotonic())
+            ServerState.checks["duckduckgo"] = "ok"
+            break
+        ServerState.checks["duckduckgo"] = "unreachable"
+        logging.warning(f"DuckDuckGo not reachable during warm-up, retrying in {WARMUP_RETRY_SECONDS}s")
+        await asyncio.sleep(WARMUP_RETRY_SECONDS)
+
+    ServerState.ready = True
+    logging.info("Warm-up complete, server is ready")
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Uvicorn started directly (not via __main__) still picks up TTS from the environment
+    if TTSEngine.get_instance() is None and os.getenv('TIKTOK_SESSION_ID'):
+        TTSEngine.initialize(session_id=os.getenv('TIKTOK_SESSION_ID'))
+    warm_up_task = asyncio.create_task(warm_up())
+    tts_engine = TTSEngine.get_instance()
+    if tts_engine and os.getenv("VOICE_PROBE_DISABLED", "").lower() not in ("1", "true"):
+        voice_health.start(tts_engine)
+    yield
+    warm_up_task.cancel()
+    voice_health.stop()
+    tts_engine = TTSEngine.get_instance()
+    if tts_engine:
+        await tts_engine.close()
+    if ServerState.http_client is not None:
+        await ServerState.http_client.aclose()
+
+app = FastAPI(lifespan=lifespan)
+
+model_router = ModelRouter(ROUTING_ALIASES)
+
+voice_health = VoiceHealthProber(
+    VOICES, VOICE_FALLBACKS,
+    interval_seconds=int(os.getenv("VOICE_PROBE_INTERVAL_SECONDS", 1800)),
+    initial_delay_seconds=int(os.getenv("VOICE_PROBE_INITIAL_DELAY_SECONDS", 300)),
+    probe_voices=[voice_id.strip() for voice_id in os.getenv("VOICE_PROBE_VOICES", "").split(",") if voice_id.strip()] or None,
+    unreliable_voices=UNRELIABLE_VOICES,
+    unreliable_every=int(os.getenv("VOICE_PROBE_UNRELIABLE_EVERY", 6))
+)
+
+setup_logging()
 app.add_middleware(
     CORSMiddleware,
     allow_origins=["*"],
@@ -33,37 +121,65 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-# Store active conversations
-conversations: Dict[str, List[ChatMessage]] = {}
+# Store active conversations, histories with a common prefix share it
+conversations = ConversationStore()
+
+# Generated audio is kept here as raw bytes and referenced by AudioData.id
+audio_store = AudioStore(
+    max_bytes=int(os.getenv("AUDIO_STORE_MAX_BYTES", 64 * 1024 * 1024)),
+    ttl_seconds=int(os.getenv("AUDIO_STORE_TTL_SECONDS", 3600))
+)
 
-ua = UserAgent()
+def get_user_agent_provider():
+    if ServerState.user_agent is None:
+        from fake_useragent import UserAgent
+        ServerState.user_agent = UserAgent()
+    return ServerState.user_agent
 
 def get_next_user_agent():
-    return ua.random
+    return get_user_agent_provider().random
+
+def take_prefetched_vqd_token():
+    """Returns (user_agent, vqd_token) fetched during warm-up if still fresh, only once"""
+    prefetched, ServerState.prefetched_vqd = ServerState.prefetched_vqd, None
+    if prefetched and time.monotonic() - prefetched[2] < PREFETCHED_VQD_MAX_AGE:
+        return prefetched[0], prefetched[1]
+    return None
 
 async def update_vqd_token(user_agent):
-    async with httpx.AsyncClient() as client:
-        try:
-            await client.get("https://duckduckgo.com/country.json", headers={"User-Agent": user_agent})
-            headers = {"x-vqd-accept": "1", "User-Agent": user_agent}
-            response = await client.get("https://duckduckgo.com/duckchat/v1/status", headers=headers)
-            if response.status_code == 200:
-                vqd_token = response.headers.get("x-vqd-4", "")
-                logging.info(f"Fetched new x-vqd-4 token: {vqd_token}")
-                return vqd_token
-            else:
-                logging.warning(f"Failed to fetch x-vqd-4 token. Status code: {response.status_code}")
-                return ""
-        except Exception as e:
-            logging.error(f"Error fetching x-vqd-4 token: {str(e)}")
+    client = get_http_client()
+    try:
+        country_response = await client.get("https://duckduckgo.com/country.json", headers={"User-Agent": user_agent})
+        headers = {"x-vqd-accept": "1", "User-Agent": user_agent}
+        # Cookies only carry over within this token fetch, like they did with a client per call
+        if country_response.cookies:
+            headers["Cookie"] = "; ".join(f"{name}={value}" for name, value in country_response.cookies.items())
+        response = await client.get("https://duckduckgo.com/duckchat/v1/status", headers=headers)
+        if response.status_code == 200:
+            vqd_token = response.headers.get("x-vqd-4", "")
+            logging.info(f"Fetched new x-vqd-4 token: {vqd_token}")
+            return vqd_token
+        else:
+            logging.warning(f"Failed to fetch x-vqd-4 token. Status code: {response.status_code}")
             return ""
-
-async def chat_with_duckduckgo(query: str, model: str, conversation_history: List[ChatMessage]):
-    original_model = MODEL_MAPPING.get(model, model)
+    except Exception as e:
+        logging.error(f"Error fetching x-vqd-4 token: {str(e)}")
+        return ""
+
+async def obtain_vqd_token():
+    """Returns (user_agent, vqd_token) for one chat request, raises an HTTPException if none can be fetched"""
+    prefetched = take_prefetched_vqd_token()
+    if prefetched:
+        return prefetched
     user_agent = get_next_user_agent()
     vqd_token = await update_vqd_token(user_agent)
     if not vqd_token:
         raise HTTPException(status_code=500, detail="Failed to obtain VQD token")
+    return user_agent, vqd_token
+
+async def chat_with_duckduckgo(query: str, model: str, conversation_history: List[MessageNode], max_retries: int = 5, vqd: Optional[tuple] = None):
+    original_model = MODEL_MAPPING.get(model, model)
+    user_agent, vqd_token = vqd or await obtain_vqd_token()
 
     # If there is a system message, add it before the first user message (DDG AI doesnt let us send system messages, so this is a workaround -- fundamentally, it works the same way when setting a system prompt)
     system_message = next((msg for msg in conversation_history if msg.role == "system"), None)
@@ -91,66 +207,155 @@ async def chat_with_duckduckgo(query: str, model: str, conversation_history: Lis
         "User-Agent": user_agent
     }
 
-    logging.info(f"Sending payload to DuckDuckGo with User-Agent: {user_agent}")
+    log_event("chat.upstream", "Sending payload to DuckDuckGo", level=logging.DEBUG,
+              model=original_model, messages=len(messages), user_agent=user_agent)
     # swapped to stream using client.stream() - no more artificial streaming
-    async with httpx.AsyncClient() as client:
-        try:
-            async with client.stream('POST', "https://duckduckgo.com/duckchat/v1/chat", json=payload, headers=headers) as response:
-                if response.status_code == 200:
-                    async for line in response.aiter_lines():
-                        if line.startswith("data: "):
-                            data = line[6:].strip()
-                            if data == "[DONE]":
-                                break
-                            try:
-                                json_data = json.loads(data)
-                                message = json_data.get("message", "")
-                                yield message
-                            except json.JSONDecodeError:
-                                logging.warning(f"Failed to parse JSON: {data}")
-                elif response.status_code == 429:
-                    for attempt in range(5): # Try up to 5 times
-                        user_agent = get_next_user_agent()
-                        vqd_token = await update_vqd_token(user_agent)
-                        headers.update({
-                            "User-Agent": user_agent,
-                            "x-vqd-4": vqd_token
-                        })
-                        async with client.stream('POST', "https://duckduckgo.com/duckchat/v1/chat", json=payload, headers=headers) as retry_response:
-                            if retry_response.status_code == 200:
-                                async for line in retry_response.aiter_lines():
-                                    if line.startswith("data: "):
-                                        data = line[6:].strip()
-                                        if data == "[DONE]":
-                                            break
-                                        try:
-                                            json_data = json.loads(data)
-                                            message = json_data.get("message", "")
-                                            yield message
-                                        except json.JSONDecodeError:
-                                            logging.warning(f"Failed to parse JSON: {data}")
-                                break
-                    else:
-                        raise HTTPException(status_code=429, detail="Rate limit exceeded. Please try again later.")
+    client = get_http_client()
+    try:
+        async with client.stream('POST', "https://duckduckgo.com/duckchat/v1/chat", json=payload, headers=headers) as response:
+            if response.status_code == 200:
+                async for line in response.aiter_lines():
+                    if line.startswith("data: "):
+                        data = line[6:].strip()
+                        if data == "[DONE]":
+                            break
+                        try:
+                            json_data = json.loads(data)
+                            message = json_data.get("message", "")
+                            yield message
+                        except json.JSONDecodeError:
+                            logging.warning(f"Failed to parse JSON: {data}")
+            elif response.status_code == 429:
+                for attempt in range(max_retries): # Try up to max_retries times
+                    user_agent = get_next_user_agent()
+                    vqd_token = await update_vqd_token(user_agent)
+                    headers.update({
+                        "User-Agent": user_agent,
+                        "x-vqd-4": vqd_token
+                    })
+                    async with client.stream('POST', "https://duckduckgo.com/duckchat/v1/chat", json=payload, headers=headers) as retry_response:
+                        if retry_response.status_code == 200:
+                            async for line in retry_response.aiter_lines():
+                                if line.startswith("data: "):
+                                    data = line[6:].strip()
+                                    if data == "[DONE]":
+                                        break
+                                    try:
+                                        json_data = json.loads(data)
+                                        message = json_data.get("message", "")
+                                        yield message
+                                    except json.JSONDecodeError:
+                                        logging.warning(f"Failed to parse JSON: {data}")
+                            break
                 else:
-                    logging.error(f"Error response from DuckDuckGo. Status code: {response.status_code}")
-                    raise HTTPException(status_code=response.status_code, detail=f"Error communicating with DuckDuckGo: {response.text}")
-        except httpx.HTTPStatusError as e:
-            logging.error(f"HTTP error occurred: {str(e)}")
-            raise HTTPException(status_code=e.response.status_code, detail=str(e))
-        except httpx.RequestError as e:
-            logging.error(f"Request error occurred: {str(e)}")
-            raise HTTPException(status_code=500, detail=str(e))
-        except Exception as e:
-            logging.error(f"Unexpected error in chat_with_duckduckgo: {str(e)}")
-            raise HTTPException(status_code=500, detail=f"Unexpected error: {str(e)}")
+                    raise HTTPException(status_code=429, detail="Rate limit exceeded. Please try again later.")
+            else:
+                logging.error(f"Error response from DuckDuckGo. Status code: {response.status_code}")
+                raise HTTPException(status_code=response.status_code, detail=f"Error communicating with DuckDuckGo: {response.text}")
+    except HTTPException:
+        raise
+    except httpx.HTTPStatusError as e:
+        logging.error(f"HTTP error occurred: {str(e)}")
+        raise HTTPException(status_code=e.response.status_code, detail=str(e))
+    except httpx.RequestError as e:
+        logging.error(f"Request error occurred: {str(e)}")
+        raise HTTPException(status_code=500, detail=str(e))
+    except Exception as e:
+        logging.error(f"Unexpected error in chat_with_duckduckgo: {str(e)}")
+        raise HTTPException(status_code=500, detail=f"Unexpected error: {str(e)}")
+
+async def chat_with_routing(query: str, model: str, conversation_history: List[MessageNode]):
+    """Stream a chat response, recording time to first token and errors per model.
+
+    For routing aliases the best performing model is tried first, falling back
+    to the next one as long as nothing has been streamed yet. Only the last
+    candidate retries on a 429, the others hand over to the next model at once.
+    """
+    candidates = model_router.candidates(model) if model_router.is_alias(model) else [model]
+    last_error = None
+    for candidate in candidates:
+        # Fetched outside the try: a token failure is the same for every model, so it is neither
+        # counted against this one nor a reason to fall back, and it stays out of the TTFT sample
+        vqd = await obtain_vqd_token()
+        started = time.monotonic()
+        streamed = False
+        try:
+            max_retries = 0 if candidate != candidates[-1] else 5
+            async for chunk in chat_with_duckduckgo(query, candidate, conversation_history, max_retries=max_retries, vqd=vqd):
+                if not streamed:
+                    model_router.record_success(candidate, time.monotonic() - started)
+                    streamed = True
+                yield chunk
+            if not streamed:
+                model_router.record_success(candidate, time.monotonic() - started)
+            return
+        except HTTPException as e:
+            model_router.record_failure(candidate, counted=streamed)
+            if streamed:
+                raise
+            last_error = e
+            if candidate != candidates[-1]:
+                log_event("chat.route.fallback", f"Model {candidate} failed, falling back",
+                          level=logging.WARNING, alias=model, model=candidate, status_code=e.status_code)
+    raise last_error
+
+async def synthesize_audio(tts_engine: TTSEngine, text: str, audio_config: AudioConfig, conversation_id: str) -> AudioData:
+    """Generate speech for a response and put it in the audio store, the returned AudioData holds no inline data"""
+    tiktok_voice = audio_config.voice if isinstance(audio_config.voice, str) else "en_us_002"
+    try:
+        if tiktok_voice in VOICES:
+            tiktok_voice = voice_health.resolve_voice(tiktok_voice)
+        audio_bytes = await tts_engine.generate_speech(text, tiktok_voice)
+    except Exception as e:
+        logging.error(f"Audio generation failed: {str(e)}", exc_info=True)
+        return AudioData(transcript=text)
+
+    log_event("chat.audio", f"Generated audio for voice: {tiktok_voice}",
+              conversation_id=conversation_id, voice=tiktok_voice,
+              text_chars=len(text), audio_bytes=len(audio_bytes) if audio_bytes else 0)
+    log_event("chat.audio.text", "Text converted to audio", level=logging.DEBUG,
+              conversation_id=conversation_id, text=text)
+
+    if not audio_bytes:
+        logging.error("No audio bytes received from TTS engine")
+        return AudioData(transcript=text)
+
+    stored = audio_store.put(audio_bytes)
+    if stored is None:
+        # Too large to keep, the only way to hand it over is inline
+        return AudioData(data=base64.b64encode(audio_bytes).decode('utf-8'), transcript=text)
+
+    audio_id, expires_at = stored
+    return AudioData(id=audio_id, expires_at=expires_at, transcript=text)
+
+def audio_for_response(audio: AudioData, audio_config: AudioConfig) -> AudioData:
+    """Attach base64 data only when the client asked for inline audio"""
+    if not audio_config.inline or audio.data is not None or audio.id is None:
+        return audio
+    audio_bytes = audio_store.get(audio.id)
+    if audio_bytes is None:
+        return audio
+    return audio.model_copy(update={"data": base64.b64encode(audio_bytes).decode('utf-8')})
+
+@app.get("/healthz")
+async def healthz():
+    return {"status": "ok"}
+
+@app.get("/readyz")
+async def readyz():
+    body = {"status": "ready" if ServerState.ready else "warming", "checks": ServerState.checks}
+    return JSONResponse(status_code=200 if ServerState.ready else 503, content=body)
 
 @app.get("/v1/models")
 async def list_models():
     logging.info("Listing available models")
-    models = [ModelInfo(id=model_id) for model_id in MODEL_MAPPING.keys()]
+    models = [ModelInfo(id=model_id) for model_id in list(MODEL_MAPPING.keys()) + list(ROUTING_ALIASES.keys())]
     return {"data": models, "object": "list"}
 
+@app.get("/v1/models/routing")
+async def routing_stats():
+    return model_router.snapshot()
+
 @app.get("/v1/audio/speech/voices")
 async def list_voices():
     voices = []
@@ -159,7 +364,8 @@ async def list_voices():
             "voice_id": voice_id,
             "name": info["name"],
             "language": info["language"],
-            "category": info["category"]
+            "category": info["category"],
+            "status": voice_health.status(voice_id).to_dict()
         })
     return {"voices": voices}
 
@@ -170,7 +376,8 @@ async def create_speech(request: TTSRequest):
         if not tts_engine:
             raise ValueError("TTS functionality is not available. Check TIKTOK_SESSION_ID configuration.")
 
-        audio_data = await tts_engine.generate_speech(request.input, request.voice)
+        voice = voice_health.resolve_voice(request.voice) if request.voice in VOICES else request.voice
+        audio_data = await tts_engine.generate_speech(request.input, voice)
 
         return StreamingResponse(
             iter([audio_data]),
@@ -191,8 +398,12 @@ async def create_speech(request: TTSRequest):
 async def chat_completion(request: ChatCompletionRequest):
     # Use provided conversation_id, id, or generate new one
     conversation_id = request.conversation_id or str(uuid.uuid4())
-    logging.info(f"Received chat completion request for conversation {conversation_id}")
-    logging.info(f"Request: {request.model_dump()}")
+    log_event("chat.request", f"Received chat completion request for conversation {conversation_id}",
+              conversation_id=conversation_id, model=request.model, stream=request.stream,
+              messages=len(request.messages), modalities=request.modalities)
+    if logging.getLogger().isEnabledFor(logging.DEBUG):
+        log_event("chat.request.payload", "Request payload", level=logging.DEBUG,
+                  conversation_id=conversation_id, payload=request.model_dump())
 
     # Check if audio generation is requested and available
     tts_engine = TTSEngine.get_instance()
@@ -203,22 +414,24 @@ async def chat_completion(request: ChatCompletionRequest):
         tts_engine is not None
     )
 
-    # Get existing conversation history or initialize new one
-    conversation_history = conversations.get(conversation_id, [])
-    
-    # Add new messages to history
+    # Add new messages to existing conversation history (or a new one)
+    conversations.create(conversation_id)
+    seen = {(existing.role, existing.content) for existing in conversations.messages(conversation_id)}
     for msg in request.messages:
         # Only add message if it's not already in the history
-        if not any(existing.content == msg.content and existing.role == msg.role 
-                  for existing in conversation_history):
-            conversation_history.append(msg)
-    
-    conversations[conversation_id] = conversation_history
+        if (msg.role, msg.content) not in seen:
+            if msg.audio is not None and msg.audio.data is not None:
+                # Resent audio is not kept inline, the id (if any) still points at the store
+                msg = msg.model_copy(update={"audio": msg.audio.model_copy(update={"data": None})})
+            conversations.append(conversation_id, msg)
+            seen.add((msg.role, msg.content))
+
+    conversation_history = conversations.messages(conversation_id)
 
     async def generate():
         try:
             full_response = ""
-            async for chunk in chat_with_duckduckgo(
+            async for chunk in chat_with_routing(
                 " ".join([msg.content for msg in request.messages if msg.content]),
                 request.model,
                 conversation_history
@@ -239,29 +452,9 @@ async def chat_completion(request: ChatCompletionRequest):
                 yield f"data: {response.model_dump_json()}\n\n"
 
             # Generate audio if requested (for streaming responses)
-            audio_data = None
-            audio_id = None
+            audio = None
             if generate_audio:
-                try:
-                    tiktok_voice = request.audio.voice if isinstance(request.audio.voice, str) else "en_us_002"
-                    audio_bytes = await tts_engine.generate_speech(full_response, tiktok_voice)
-                    audio_data = base64.b64encode(audio_bytes).decode('utf-8') if audio_bytes else ""
-                    audio_id = f"audio_{uuid.uuid4().hex[:12]}"
-                    logging.info(f"Starting audio generation for voice: {tiktok_voice}")
-                    logging.info(f"Text to convert: {full_response}")
-                    
-                    # Log the TTS engine state
-                    logging.info(f"TTS Engine state: {tts_engine is not None}")
-                    logging.info(f"Audio bytes received: {len(audio_bytes) if audio_bytes else 'None'}")
-                    
-                    if audio_bytes:
-                        audio_data = base64.b64encode(audio_bytes).decode('utf-8')
-                        logging.info(f"Base64 encoded data length: {len(audio_data)}")
-                    else:
-                        logging.error("No audio bytes received from TTS engine")
-                        
-                except Exception as e:
-                    logging.error(f"Audio generation failed: {str(e)}", exc_info=True)
+                audio = await synthesize_audio(tts_engine, full_response, request.audio, conversation_id)
 
             final_response = ChatCompletionStreamResponse(
                 id=conversation_id,
@@ -271,12 +464,7 @@ async def chat_completion(request: ChatCompletionRequest):
                     ChatCompletionStreamResponseChoice(
                         index=0,
                         delta=DeltaMessage(
-                            audio=AudioData(
-                                id=audio_id,
-                                expires_at=int((datetime.now() + timedelta(hours=1)).timestamp()),
-                                data=audio_data,
-                                transcript=full_response
-                            ) if generate_audio else None
+                            audio=audio_for_response(audio, request.audio) if audio else None
                         ),
                         finish_reason="stop"
                     )
@@ -292,7 +480,7 @@ async def chat_completion(request: ChatCompletionRequest):
         return StreamingResponse(generate(), media_type="text/event-stream")
     else:
         full_response = ""
-        async for chunk in chat_with_duckduckgo(
+        async for chunk in chat_with_routing(
             " ".join([msg.content for msg in request.messages if msg.content]), 
             request.model,
             conversation_history
@@ -300,48 +488,26 @@ async def chat_completion(request: ChatCompletionRequest):
             full_response += chunk
 
         # Generate audio if requested (for non-streaming responses)
-        audio_data = None
-        audio_id = None
+        audio = None
         if generate_audio:
-            try:
-                tiktok_voice = request.audio.voice if isinstance(request.audio.voice, str) else "en_us_002"
-                audio_bytes = await tts_engine.generate_speech(full_response, tiktok_voice)
-                audio_data = base64.b64encode(audio_bytes).decode('utf-8') if audio_bytes else ""
-                audio_id = f"audio_{uuid.uuid4().hex[:12]}"
-                logging.info(f"Starting audio generation for voice: {tiktok_voice}")
-                logging.info(f"Text to convert: {full_response}")
-                
-                # Log the TTS engine state
-                logging.info(f"TTS Engine state: {tts_engine is not None}")
-                logging.info(f"Audio bytes received: {len(audio_bytes) if audio_bytes else 'None'}")
-            
-                if audio_bytes:
-                    audio_data = base64.b64encode(audio_bytes).decode('utf-8')
-                    logging.info(f"Base64 encoded data length: {len(audio_data)}")
-                else:
-                    logging.error("No audio bytes received from TTS engine")
-            except Exception as e:
-                logging.error(f"Audio generation failed: {str(e)}", exc_info=True)
+            audio = await synthesize_audio(tts_engine, full_response, request.audio, conversation_id)
 
         # Calculate token counts
         prompt_tokens = sum(len(msg.content.split()) if msg.content else 0 for msg in conversation_history)
         completion_tokens = len(full_response.split())
         total_tokens = prompt_tokens + completion_tokens
 
-        # Create and store assistant's response
+        # Create and store assistant's response, history only keeps the audio reference
         assistant_message = ChatMessage(
             role="assistant",
             content=full_response if not generate_audio else None,
-            audio=AudioData(
-                id=audio_id,
-                expires_at=int((datetime.now() + timedelta(hours=1)).timestamp()),
-                data=audio_data,
-                transcript=full_response
-            ) if generate_audio else None
+            audio=audio
         )
         
-        conversation_history.append(assistant_message)
-        conversations[conversation_id] = conversation_history
+        conversations.append(conversation_id, assistant_message)
+
+        if audio is not None:
+            assistant_message = assistant_message.model_copy(update={"audio": audio_for_response(audio, request.audio)})
 
         response = ChatCompletionResponse(
             id=conversation_id,
@@ -363,10 +529,125 @@ async def chat_completion(request: ChatCompletionRequest):
         
         return response
 
+@app.websocket("/v1/conversations/{conversation_id}/ws")
+async def conversation_session(websocket: WebSocket, conversation_id: str, model: str = "keyless-gpt-4o-mini", voice: Optional[str] = None):
+    """Persistent session bound to one conversation.
+
+    Clients send only the new user message, either as plain text or as JSON
+    {"content": ..., "model": ..., "voice": ...}. Text deltas come back as JSON
+    frames and, if a voice is set, the speech as binary frames.
+    """
+    await websocket.accept()
+    conversations.create(conversation_id)
+    log_event("ws.connect", f"Session opened for conversation {conversation_id}",
+              conversation_id=conversation_id, model=model, voice=voice)
+    await websocket.send_json({"type": "session", "conversation_id": conversation_id, "model": model, "voice": voice})
+
+    try:
+        while True:
+            frame = await websocket.receive_text()
+            try:
+                turn = json.loads(frame) if frame.startswith("{") else {"content": frame}
+            except json.JSONDecodeError:
+                await websocket.send_json({"type": "error", "detail": "Invalid JSON message"})
+                continue
+            content = turn.get("content")
+            if not isinstance(content, str) or not content:
+                await websocket.send_json({"type": "error", "detail": "Message content must be a non-empty string"})
+                continue
+            turn_model = turn.get("model", model)
+            turn_voice = turn.get("voice", voice)
+            if not isinstance(turn_model, str) or (turn_voice is not None and not isinstance(turn_voice, str)):
+                await websocket.send_json({"type": "error", "detail": "model and voice must be strings"})
+                continue
+
+            # Clients only ever add user messages to the shared history
+            conversations.append(conversation_id, ChatMessage(role="user", content=content))
+            conversation_history = conversations.messages(conversation_id)
+
+            full_response = ""
+            try:
+                async for chunk in chat_with_routing(content, turn_model, conversation_history):
+                    full_response += chunk
+                    await websocket.send_json({"type": "delta", "content": chunk})
+            except HTTPException as e:
+                await websocket.send_json({"type": "error", "status_code": e.status_code, "detail": e.detail})
+                continue
+
+            conversations.append(conversation_id, ChatMessage(role="assistant", content=full_response))
+
+            tts_engine = TTSEngine.get_instance()
+            if turn_voice and tts_engine and full_response:
+                audio_bytes = 0
+                try:
+                    tiktok_voice = voice_health.resolve_voice(turn_voice) if turn_voice in VOICES else turn_voice
+                    async for chunk_audio in tts_engine.iter_speech(full_response, tiktok_voice):
+                        audio_bytes += len(chunk_audio)
+                        await websocket.send_bytes(chunk_audio)
+                    await websocket.send_json({"type": "audio.done", "voice": tiktok_voice, "bytes": audio_bytes})
+                except WebSocketDisconnect:
+                    raise
+                except Exception as e:
+                    logging.error(f"Audio generation failed: {str(e)}")
+                    await websocket.send_json({"type": "error", "detail": f"Audio generation failed: {str(e)}"})
+
+            prompt_tokens = sum(len(msg.content.split()) if msg.content else 0 for msg in conversation_history)
+            completion_tokens = len(full_response.split())
+            await websocket.send_json({
+                "type": "done",
+                "usage": {
+                    "prompt_tokens": prompt_tokens,
+                    "completion_tokens": completion_tokens,
+                    "total_tokens": prompt_tokens + completion_tokens
+                }
+            })
+    except WebSocketDisconnect:
+        log_event("ws.disconnect", f"Session closed for conversation {conversation_id}", conversation_id=conversation_id)
+
+@app.get("/v1/audio/{audio_id}")
+async def get_audio(audio_id: str):
+    audio_bytes = audio_store.get(audio_id)
+    if audio_bytes is None:
+        raise HTTPException(status_code=404, detail="Audio not found or expired")
+    return StreamingResponse(
+        AudioStore.iter_chunks(audio_bytes),
+        media_type="audio/mpeg",
+        headers={"Content-Length": str(len(audio_bytes))}
+    )
+
+@app.get("/v1/logging")
+async def get_logging_settings():
+    return {"level": get_log_level(), "sample_rates": get_sample_rates()}
+
+@app.put("/v1/logging")
+async def update_logging_settings(settings: LoggingSettings):
+    try:
+        if settings.level is not None:
+            set_log_level(settings.level)
+        if settings.sample_rates is not None:
+            set_sample_rates(settings.sample_rates)
+    except (ValueError, TypeError) as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    logging.info(f"Logging settings updated: level={get_log_level()} sample_rates={get_sample_rates()}")
+    return {"level": get_log_level(), "sample_rates": get_sample_rates()}
+
+@app.post("/v1/conversations/{conversation_id}/fork")
+async def fork_conversation(conversation_id: str, messages: Optional[int] = None):
+    """Start a new conversation from this one (or its first `messages` messages), sharing its history"""
+    if conversation_id not in conversations:
+        raise HTTPException(status_code=404, detail="Conversation not found")
+    if messages is not None and messages < 0:
+        raise HTTPException(status_code=400, detail="messages must not be negative")
+    new_conversation_id = str(uuid.uuid4())
+    conversations.fork(conversation_id, new_conversation_id, length=messages)
+    logging.info(f"Conversation {conversation_id} forked into {new_conversation_id}")
+    return {"conversation_id": new_conversation_id, "messages": len(conversations.messages(new_conversation_id))}
+
 @app.delete("/v1/conversations/{conversation_id}")
 async def end_conversation(conversation_id: str):
     if conversation_id in conversations:
-        del conversations[conversation_id]
+        for audio_id in conversations.pop(conversation_id):
+            audio_store.delete(audio_id)
         logging.info(f"Conversation {conversation_id} ended and context cleared")
         return {"message": f"Conversation {conversation_id} ended and context cleared."}
     else:
@@ -1,8 +1,14 @@
 import httpx
 import base64
 import logging
-from typing import Optional, List
+from typing import Optional, List, Dict, AsyncIterator
 from models import BaseModel
+from logging_config import log_event
+
+TTS_HOST = "api16-normal-useast5.us.tiktokv.com"
+DEFAULT_CHUNK_SIZE = 200
+MAX_CHUNK_SIZE = 1000
+CHUNK_GROWTH_FACTOR = 1.25
 
 
 class TTSRequest(BaseModel):
@@ -12,6 +18,56 @@ class TTSRequest(BaseModel):
     response_format: str = "mp3"
     speed: float = 1.0
 
+class VoiceRejectedError(ValueError):
+    """The TTS upstream answered, but refused to synthesize with the requested voice"""
+
+
+class InvalidSessionError(ValueError):
+    """The TTS upstream rejected the TikTok session ID"""
+
+
+class ChunkSizeTracker:
+    """Learns the largest chunk length the upstream accepts for each voice.
+
+    Until a rejection is seen the limit grows past the longest accepted chunk,
+    afterwards it bisects between the longest accepted and shortest rejected
+    length, so later requests are split right the first time.
+    """
+
+    def __init__(self, default_size: int = DEFAULT_CHUNK_SIZE, max_size: int = MAX_CHUNK_SIZE):
+        self.default_size = default_size
+        self.max_size = max_size
+        self.longest_accepted: Dict[str, int] = {}
+        self.shortest_rejected: Dict[str, int] = {}
+
+    def limit(self, voice: str) -> int:
+        accepted = self.longest_accepted.get(voice, 0)
+        rejected = self.shortest_rejected.get(voice)
+        if rejected is None:
+            return min(self.max_size, max(self.default_size, int(accepted * CHUNK_GROWTH_FACTOR)))
+        return max(accepted, (accepted + rejected) // 2, 1)
+
+    def record_accepted(self, voice: str, length: int):
+        if length > self.longest_accepted.get(voice, 0):
+            self.longest_accepted[voice] = length
+        rejected = self.shortest_rejected.get(voice)
+        if rejected is not None and length >= rejected:
+            # Upstream changed its mind, forget the stale rejection
+            del self.shortest_rejected[voice]
+
+    def record_rejected(self, voice: str, length: int):
+        if length < self.shortest_rejected.get(voice, length + 1):
+            self.shortest_rejected[voice] = length
+        if self.longest_accepted.get(voice, 0) >= length:
+            self.longest_accepted[voice] = length - 1
+
+    def stats(self, voice: str) -> Dict[str, Optional[int]]:
+        return {
+            "chunk_size": self.limit(voice),
+            "longest_accepted": self.longest_accepted.get(voice),
+            "shortest_rejected": self.shortest_rejected.get(voice)
+        }
+
 class TTSEngine:
     _instance: Optional['TTSEngine'] = None
     
@@ -44,62 +100,93 @@ class TTSEngine:
             'User-Agent': "com.zhiliaoapp.musically/2022600030 (Linux; U; Android 7.1.2; es_ES; SM-G988N; Build/NRD90M;tt-ok/3.12.13.1)",
             'Cookie': f'sessionid={session_id}'
         }
+        self._client: Optional[httpx.AsyncClient] = None
+        self.chunk_sizes = ChunkSizeTracker()
+
+    def get_client(self) -> httpx.AsyncClient:
+        """Pooled client so every chunk reuses the same TLS connection"""
+        if self._client is None or self._client.is_closed:
+            self._client = httpx.AsyncClient(timeout=httpx.Timeout(30.0, connect=10.0))
+        return self._client
+
+    async def warm_up(self) -> bool:
+        """Open a connection to the TTS host ahead of the first request, returns whether it is reachable"""
+        try:
+            await self.get_client().head(f"https://{TTS_HOST}/", headers=self.headers)
+            return True
+        except httpx.HTTPError as e:
+            logging.warning(f"TTS host not reachable during warm-up: {str(e)}")
+            return False
+
+    async def close(self):
+        if self._client is not None:
+            await self._client.aclose()
 
     async def generate_speech(self, text: str, voice: str = "en_us_002") -> bytes:
+        all_audio = bytearray()
+        async for chunk_audio in self.iter_speech(text, voice):
+            all_audio.extend(chunk_audio)
+        return bytes(all_audio)
+
+    async def iter_speech(self, text: str, voice: str = "en_us_002") -> AsyncIterator[bytes]:
+        """Yield audio chunk by chunk so callers can start playback before all text is synthesized"""
         try:
-            # Split text into chunks
-            chunks = self._split_text(text)
-            logging.info(f"Split text into {len(chunks)} chunks")
+            # Split text into chunks using the largest size known to work for this voice
+            chunks = self._split_text(text, max_size=self.chunk_sizes.limit(voice))
             
-            all_audio = bytearray()
+            total_bytes = 0
             
             for i, chunk in enumerate(chunks, 1):
                 try:
-                    sanitized_text = TextProcessor.sanitize_text(chunk)
-                    url = f"https://api16-normal-useast5.us.tiktokv.com/media/api/text/speech/invoke/?text_speaker={voice}&req_text={sanitized_text}&speaker_map_type=0&aid=1233"
-                    
-                    logging.info(f"Processing chunk {i}/{len(chunks)} of length {len(chunk)}")
-                    logging.info(f"Sanitized text: {sanitized_text[:50]}...")
-                    
-                    async with httpx.AsyncClient() as client:
-                        response = await client.post(url, headers=self.headers)
-                        #logging.info(f"TikTok API response status for chunk {i}: {response.status_code}")
-                        
-                        response_data = response.json()
-                        #logging.info(f"TikTok API response for chunk {i}: {response_data}")
-                        
-                        if response_data.get("message") == "Couldn't load speech. Try again.":
-                            raise ValueError("Invalid session ID")
-
-                        if response_data.get("status_code") == 2:
-                            logging.warning(f"Chunk {i} too long, attempting to split further")
-                            # Recursively try with smaller chunks
-                            smaller_chunks = self._split_text(chunk, max_size=len(chunk) // 2)
-                            for small_chunk in smaller_chunks:
-                                small_chunk_audio = await self.generate_speech(small_chunk, voice)
-                                all_audio.extend(small_chunk_audio)
-                            continue
-
-                        if 'data' not in response_data or 'v_str' not in response_data['data']:
-                            error_msg = response_data.get('message', 'Unknown error occurred')
-                            raise ValueError(f"TikTok API error: {error_msg}")
-
-                        chunk_audio = base64.b64decode(response_data["data"]["v_str"])
-                        logging.info(f"Received audio data for chunk {i}, length: {len(chunk_audio)} bytes")
-                        all_audio.extend(chunk_audio)
-                        
+                    log_event("tts.chunk", f"Processing chunk {i}/{len(chunks)}", level=logging.DEBUG,
+                              voice=voice, chunk=i, chunks=len(chunks), chars=len(chunk), text=chunk)
+                    chunk_audio = await self._synthesize_chunk(chunk, voice)
                 except Exception as e:
                     logging.error(f"Error processing chunk {i}: {str(e)}")
                     raise
+                total_bytes += len(chunk_audio)
+                yield chunk_audio
 
-            logging.info(f"Successfully generated audio for all chunks. Total size: {len(all_audio)} bytes")
-            return bytes(all_audio)
+            log_event("tts.speech", "Successfully generated audio for all chunks",
+                      voice=voice, chunks=len(chunks), audio_bytes=total_bytes)
                 
         except Exception as e:
             logging.error(f"Speech generation failed: {str(e)}", exc_info=True)
             raise
 
-    def _split_text(self, text: str, max_size: int = 200) -> List[str]:
+    async def _synthesize_chunk(self, chunk: str, voice: str) -> bytes:
+        sanitized_text = TextProcessor.sanitize_text(chunk)
+        url = f"https://{TTS_HOST}/media/api/text/speech/invoke/?text_speaker={voice}&req_text={sanitized_text}&speaker_map_type=0&aid=1233"
+
+        response = await self.get_client().post(url, headers=self.headers)
+        response_data = response.json()
+
+        if response_data.get("message") == "Couldn't load speech. Try again.":
+            raise InvalidSessionError("Invalid session ID")
+
+        if response_data.get("status_code") == 2:
+            self.chunk_sizes.record_rejected(voice, len(chunk))
+            smaller_chunks = self._split_text(chunk, max_size=min(self.chunk_sizes.limit(voice), len(chunk) - 1))
+            if len(smaller_chunks) <= 1:
+                raise ValueError(f"Text too long for TTS and cannot be split further: {chunk[:50]}")
+            log_event("tts.chunk.rejected", f"Chunk of {len(chunk)} chars too long, split into {len(smaller_chunks)}",
+                      level=logging.WARNING, voice=voice, **self.chunk_sizes.stats(voice))
+            audio = bytearray()
+            for small_chunk in smaller_chunks:
+                audio.extend(await self._synthesize_chunk(small_chunk, voice))
+            return bytes(audio)
+
+        if 'data' not in response_data or 'v_str' not in response_data['data']:
+            error_msg = response_data.get('message', 'Unknown error occurred')
+            raise VoiceRejectedError(f"TikTok API error: {error_msg}")
+
+        self.chunk_sizes.record_accepted(voice, len(chunk))
+        chunk_audio = base64.b64decode(response_data["data"]["v_str"])
+        log_event("tts.chunk.audio", "Received audio data for chunk", level=logging.DEBUG,
+                  voice=voice, chars=len(chunk), audio_bytes=len(chunk_audio))
+        return chunk_audio
+
+    def _split_text(self, text: str, max_size: int = DEFAULT_CHUNK_SIZE) -> List[str]:
         paragraphs = text.split('\n')
         chunks = []
         current_chunk = ""
@@ -109,29 +196,24 @@ class TTSEngine:
             sentences = [s.strip() + '.' for s in paragraph.split('.') if s.strip()]
             
             for sentence in sentences:
-                # If this sentence alone is longer than max_size, split it by commas
+                # If this sentence alone is longer than max_size, split it by commas (then words)
                 if len(sentence) > max_size:
-                    comma_parts = [p.strip() + ',' for p in sentence.split(',') if p.strip()]
-                    for part in comma_parts:
-                        if len(current_chunk) + len(part) > max_size:
-                            if current_chunk:
-                                chunks.append(current_chunk.strip())
-                            current_chunk = part
-                        else:
-                            current_chunk += " " + part
+                    parts = []
+                    for p in sentence.split(','):
+                        if not p.strip():
+                            continue
+                        part = p.strip() + ','
+                        parts.extend([part] if len(part) <= max_size else part.split())
                 else:
-                    # If adding this sentence would exceed the limit, start a new chunk
-                    if len(current_chunk) + len(sentence) > max_size:
-                        if current_chunk:
-                            chunks.append(current_chunk.strip())
-                        current_chunk = sentence
+                    parts = [sentence]
+
+                for part in parts:
+                    # Count the joining space, a chunk must never be longer than max_size
+                    if current_chunk and len(current_chunk) + 1 + len(part) > max_size:
+                        chunks.append(current_chunk)
+                        current_chunk = part
                     else:
-                        current_chunk += " " + sentence
-            
-            # Add paragraph break if not at the end
-            if current_chunk:
-                chunks.append(current_chunk.strip())
-                current_chunk = ""
+                        current_chunk = f"{current_chunk} {part}" if current_chunk else part
         
         # Add the last chunk if it's not empty
         if current_chunk:
@@ -140,7 +222,8 @@ class TTSEngine:
         # Filter out empty chunks and strip whitespace
         chunks = [chunk.strip() for chunk in chunks if chunk.strip()]
         
-        logging.info(f"Split text into {len(chunks)} chunks: {[len(c) for c in chunks]} chars each")
+        log_event("tts.split", f"Split text into {len(chunks)} chunks", level=logging.DEBUG,
+                  sizes=[len(c) for c in chunks])
         return chunks
 
 
@@ -0,0 +1,145 @@
+import time
+import random
+import asyncio
+import logging
+from typing import Optional, Dict, Any, Iterable, List
+from logging_config import log_event
+from tts import VoiceRejectedError, InvalidSessionError
+
+PROBE_TEXT = "Hi."
+
+
+class VoiceStatus:
+    __slots__ = ("available", "latency_ms", "checked_at", "error")
+
+    def __init__(self):
+        self.available: Optional[bool] = None  # None until the voice has been probed
+        self.latency_ms: Optional[int] = None
+        self.checked_at: Optional[int] = None
+        self.error: Optional[str] = None
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "available": self.available,
+            "latency_ms": self.latency_ms,
+            "checked_at": self.checked_at,
+            "error": self.error
+        }
+
+
+class VoiceHealthProber:
+    """Periodically synthesizes a short phrase with every voice to learn which ones work upstream"""
+
+    def __init__(self, voices: Dict[str, Dict[str, str]], fallbacks: Dict[str, str],
+                 interval_seconds: int = 1800, concurrency: int = 4,
+                 initial_delay_seconds: int = 300, probe_voices: Optional[Iterable[str]] = None,
+                 unreliable_voices: Iterable[str] = (), unreliable_every: int = 6):
+        self.voices = voices
+        self.fallbacks = fallbacks
+        self.interval_seconds = interval_seconds
+        self.concurrency = concurrency
+        # The first round waits between one and two initial delays, so new instances don't probe while warming up
+        self.initial_delay_seconds = initial_delay_seconds
+        self.probe_voices = [voice_id for voice_id in (probe_voices or voices) if voice_id in voices]
+        # Voices expected to be broken are only probed every `unreliable_every` rounds
+        self.unreliable_voices = set(unreliable_voices)
+        self.unreliable_every = max(unreliable_every, 1)
+        self.statuses: Dict[str, VoiceStatus] = {voice_id: VoiceStatus() for voice_id in voices}
+        self._task: Optional[asyncio.Task] = None
+
+    def status(self, voice_id: str) -> Optional[VoiceStatus]:
+        return self.statuses.get(voice_id)
+
+    def is_known_bad(self, voice_id: str) -> bool:
+        status = self.statuses.get(voice_id)
+        return status is not None and status.available is False
+
+    def resolve_voice(self, voice_id: str) -> str:
+        """Return the voice to use, falling back within the same language if the voice is known to be broken.
+
+        Raises ValueError if the voice is broken and there is no working fallback.
+        """
+        if not self.is_known_bad(voice_id):
+            return voice_id
+
+        language = self.voices[voice_id]["language"]
+        fallback = self.fallbacks.get(language)
+        if fallback and fallback != voice_id and not self.is_known_bad(fallback):
+            logging.info(f"Voice {voice_id} is unavailable, falling back to {fallback}")
+            return fallback
+
+        raise ValueError(f"Voice {voice_id} is currently unavailable upstream: {self.statuses[voice_id].error}")
+
+    async def probe_voice(self, tts_engine, voice_id: str):
+        status = self.statuses[voice_id]
+        started = time.monotonic()
+        try:
+            await tts_engine.generate_speech(PROBE_TEXT, voice_id)
+            status.available = True
+            status.error = None
+        except VoiceRejectedError as e:
+            # Only an actual upstream verdict marks a voice as broken
+            status.available = False
+            status.error = str(e)
+        except InvalidSessionError:
+            # Says nothing about the voice itself
+            raise
+        except Exception as e:
+            # Network trouble or an unparseable reply, leave the previous verdict in place
+            log_event("voice.probe.error", f"Probing voice {voice_id} failed: {str(e)}",
+                      level=logging.WARNING, voice=voice_id)
+            return
+        status.latency_ms = int((time.monotonic() - started) * 1000)
+        status.checked_at = int(time.time())
+
+    def voices_for_round(self, round_number: int) -> List[str]:
+        if round_number % self.unreliable_every == 0:
+            return list(self.probe_voices)
+        return [voice_id for voice_id in self.probe_voices if voice_id not in self.unreliable_voices]
+
+    async def probe_all(self, tts_engine, voice_ids: Optional[List[str]] = None):
+        voice_ids = self.probe_voices if voice_ids is None else voice_ids
+        semaphore = asyncio.Semaphore(self.concurrency)
+
+        session_invalid = asyncio.Event()
+
+        async def probe(voice_id: str):
+            async with semaphore:
+                if session_invalid.is_set():
+                    return
+                try:
+                    await self.probe_voice(tts_engine, voice_id)
+                except InvalidSessionError:
+                    session_invalid.set()
+                    raise
+
+        tasks = [asyncio.create_task(probe(voice_id)) for voice_id in voice_ids]
+        try:
+            await asyncio.gather(*tasks)
+        except InvalidSessionError:
+            # Every other probe would fail the same way, don't send them
+            for task in tasks:
+                task.cancel()
+            raise
+        broken = [voice_id for voice_id in voice_ids if self.is_known_bad(voice_id)]
+        log_event("voice.probe", f"Probed {len(voice_ids)} voices, {len(broken)} unavailable", broken=broken)
+
+    async def run(self, tts_engine):
+        await asyncio.sleep(random.uniform(self.initial_delay_seconds, 2 * self.initial_delay_seconds))
+        round_number = 0
+        while True:
+            try:
+                await self.probe_all(tts_engine, self.voices_for_round(round_number))
+            except InvalidSessionError as e:
+                logging.error(f"Voice probing stopped for this round: {str(e)}")
+            round_number += 1
+            await asyncio.sleep(self.interval_seconds)
+
+    def start(self, tts_engine):
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self.run(tts_engine))
+
+    def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None